@@ -2,12 +2,23 @@ from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError
+from pymongo.errors import WriteError
+from pymongo.errors import WriteConcernError
+import asyncio
+import functools
 import os
+import time
+import gzip
+import json
 import logging
 from pathlib import Path
+from collections import deque
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta, date
 import jwt
@@ -33,6 +44,39 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 
+# Archive: entries in months older than this many closed months are moved out of time_entries
+ARCHIVE_CUTOFF_MONTHS = int(os.environ.get('ARCHIVE_CUTOFF_MONTHS', '3'))
+
+# Write batching: coalesce concurrent time entry inserts into one insert_many (opt-in).
+# A batch only fills up from concurrent requests, so keep its size at or below
+# INTERACTIVE_MAX_CONCURRENCY or batches are always flushed by the timeout.
+TIME_ENTRY_BATCH_INSERTS = os.environ.get('TIME_ENTRY_BATCH_INSERTS', 'false').lower() in ('1', 'true', 'yes')
+TIME_ENTRY_BATCH_MAX_SIZE = int(os.environ.get('TIME_ENTRY_BATCH_MAX_SIZE', '32'))
+TIME_ENTRY_BATCH_MAX_WAIT_MS = float(os.environ.get('TIME_ENTRY_BATCH_MAX_WAIT_MS', '5'))
+
+# Load shedding: (max concurrency, max queue, target latency ms, Retry-After s) per priority class,
+# each overridable with <CLASS>_MAX_CONCURRENCY, <CLASS>_MAX_QUEUE and <CLASS>_TARGET_LATENCY_MS.
+# Only heavy adapts its limit to latency: cheap calls slow down while heavy handlers hold the
+# event loop, and shrinking their limits would shed exactly the requests this is meant to protect.
+PRIORITY_CLASS_DEFAULTS = {
+    "interactive": (64, 256, None, 1),
+    "auth": (32, 128, None, 1),
+    "heavy": (4, 16, 5000, 5),
+    "standard": (32, 128, None, 1),
+}
+
+# First matching (methods, path prefix) wins, anything else is "standard"; None matches any method
+PRIORITY_CLASS_ROUTES = [
+    ("heavy", None, "/api/reports"),
+    ("heavy", None, "/api/archive"),
+    ("heavy", None, "/api/time-entries/with-calculations"),
+    ("auth", None, "/api/auth"),
+    ("interactive", {"POST", "PUT", "DELETE"}, "/api/time-entries"),
+]
+
+# Time entry dates are stored as YYYY-MM-DD strings and compared as such
+ENTRY_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
 # Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -81,12 +125,12 @@ class TimeEntry(BaseModel):
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class TimeEntryCreate(BaseModel):
-    date: str
+    date: str = Field(pattern=ENTRY_DATE_PATTERN)
     hours: float
     description: Optional[str] = None
 
 class TimeEntryUpdate(BaseModel):
-    date: Optional[str] = None
+    date: Optional[str] = Field(default=None, pattern=ENTRY_DATE_PATTERN)
     hours: Optional[float] = None
     description: Optional[str] = None
 
@@ -100,6 +144,21 @@ class SalaryReport(BaseModel):
     total_hours_delegacja: float
     total_salary: float
 
+class ArchivedMonth(BaseModel):
+    month: str  # YYYY-MM format
+    entry_count: int
+    total_hours: float
+    total_salary: float
+    archived_at: datetime
+    users: List[SalaryReport]
+
+class ArchiveRunResult(BaseModel):
+    before: str
+    archived_months: List[str]
+    skipped_months: List[str]
+    archived_entries: int
+    skipped_malformed_entries: int = 0
+
 class TimeEntryWithRate(BaseModel):
     id: str
     user_id: str
@@ -124,6 +183,64 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def is_delegacja_entry(entry: dict) -> bool:
+    # Check if "delegacja" is in the description
+    description = (entry.get("description") or "").lower()
+    return "delegacja" in description or "delegację" in description
+
+def build_salary_report(user: dict, user_entries: List[dict]) -> SalaryReport:
+    total_hours_regular = 0
+    total_hours_delegacja = 0
+    total_salary = 0
+    
+    for entry in user_entries:
+        hours = entry.get("hours", 0)
+        
+        if is_delegacja_entry(entry):
+            # Use delegacja rate
+            rate = user.get("hourly_rate_delegacja", user.get("hourly_rate", 0))
+            total_hours_delegacja += hours
+        else:
+            # Use regular rate
+            rate = user.get("hourly_rate", 0)
+            total_hours_regular += hours
+        
+        total_salary += hours * rate
+    
+    return SalaryReport(
+        user_id=user.get("id"),
+        user_name=user.get("full_name") or "",
+        position=user.get("position") or "",
+        hourly_rate=user.get("hourly_rate") or 0,
+        hourly_rate_delegacja=user.get("hourly_rate_delegacja", 0),
+        total_hours=total_hours_regular + total_hours_delegacja,
+        total_hours_delegacja=total_hours_delegacja,
+        total_salary=total_salary
+    )
+
+def shift_month(month: str, months: int) -> str:
+    year, mon = (int(part) for part in month.split("-"))
+    year, mon = divmod(year * 12 + mon - 1 + months, 12)
+    return f"{year:04d}-{mon + 1:02d}"
+
+def current_month() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+def parse_month(month: str) -> str:
+    try:
+        return datetime.strptime(month, "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Month must be in YYYY-MM format")
+
+async def ensure_month_not_archived(entry_date: str):
+    # Archived months are immutable, so entries can no longer be added to them
+    month = entry_date[:7]
+    if month >= current_month():
+        # Only closed months are ever archived, so skip the lookup for current entries
+        return
+    if await db.time_entries_archive.find_one({"month": month}, {"_id": 0, "month": 1}):
+        raise HTTPException(status_code=400, detail=f"Month {month} is archived and can no longer be changed")
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     try:
         token = credentials.credentials
@@ -146,6 +263,308 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)) -> dict
         raise HTTPException(status_code=403, detail="Admin or supervisor access required")
     return current_user
 
+# Write batching
+class InsertCoalescer:
+    """Collects inserts arriving within max_wait_ms and writes them with one insert_many.
+
+    Every caller awaits its own document's outcome: the inserted _id or the
+    write error reported for that document.
+    """
+
+    def __init__(self, collection, max_batch_size: int = 100, max_wait_ms: float = 5):
+        self.collection = collection
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+        self.metrics = {
+            "batches": 0,
+            "documents": 0,
+            "failed_documents": 0,
+            "flushed_on_size": 0,
+            "flushed_on_timeout": 0,
+            "max_batch_size_seen": 0,
+        }
+
+    async def insert(self, doc: dict) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        
+        if len(self._pending) >= self.max_batch_size:
+            self.metrics["flushed_on_size"] += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_on_timeout)
+        
+        return await future
+
+    def stats(self) -> dict:
+        batches = self.metrics["batches"]
+        avg_batch_size = self.metrics["documents"] / batches if batches else 0
+        return {
+            **self.metrics,
+            "pending": len(self._pending),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_batch_size": avg_batch_size,
+            "avg_batch_fill": avg_batch_size / self.max_batch_size,
+        }
+
+    async def close(self):
+        if self._pending:
+            self._flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_on_timeout(self):
+        self._timer = None
+        if self._pending:
+            self.metrics["flushed_on_timeout"] += 1
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[tuple]):
+        self.metrics["batches"] += 1
+        self.metrics["documents"] += len(batch)
+        self.metrics["max_batch_size_seen"] = max(self.metrics["max_batch_size_seen"], len(batch))
+        
+        docs = [doc for doc, _ in batch]
+        errors = {}
+        write_concern_error = None
+        try:
+            # Unordered, so one bad document does not fail the rest of the batch
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = error
+            if e.details.get("writeConcernErrors"):
+                write_concern_error = e.details["writeConcernErrors"][-1]
+        except Exception as e:
+            self.metrics["failed_documents"] += len(batch)
+            logger.error(f"Batched insert of {len(batch)} documents failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.metrics["failed_documents"] += len(batch) if write_concern_error else len(errors)
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(self._write_error(errors[index]))
+            elif write_concern_error:
+                # Written, but not acknowledged as the write concern requires
+                future.set_exception(WriteConcernError(
+                    write_concern_error.get("errmsg"), write_concern_error.get("code"), write_concern_error
+                ))
+            else:
+                future.set_result(doc["_id"])
+
+    @staticmethod
+    def _write_error(error: dict) -> WriteError:
+        # Same exceptions insert_one raises for a failed document
+        if error.get("code") == 11000:
+            return DuplicateKeyError(error.get("errmsg"), 11000, error)
+        return WriteError(error.get("errmsg"), error.get("code"), error)
+
+time_entry_inserts = (
+    InsertCoalescer(db.time_entries, TIME_ENTRY_BATCH_MAX_SIZE, TIME_ENTRY_BATCH_MAX_WAIT_MS)
+    if TIME_ENTRY_BATCH_INSERTS else None
+)
+
+# Load shedding
+class ConcurrencyLimiter:
+    """Concurrency limit with a bounded FIFO queue for one priority class.
+
+    With a target latency the limit is adaptive: it backs off multiplicatively
+    while requests run slower than the target and grows back additively while
+    they are fast. Without one the limit stays at max_concurrency.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, target_latency_ms: Optional[float], retry_after: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.target_latency = target_latency_ms / 1000 if target_latency_ms is not None else None
+        self.retry_after = retry_after
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self.metrics = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    async def acquire(self) -> bool:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.metrics["admitted"] += 1
+            return True
+        
+        if len(self._waiters) >= self.max_queue:
+            self.metrics["rejected"] += 1
+            return False
+        
+        self.metrics["queued"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            # release() hands the slot over by resolving the future
+            await future
+        except asyncio.CancelledError:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            elif not future.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        
+        self.metrics["admitted"] += 1
+        return True
+
+    def release(self, latency: float):
+        if self.target_latency is not None:
+            if latency > self.target_latency:
+                self.limit = max(1.0, self.limit * 0.9)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+        
+        self.in_flight -= 1
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "limit": int(self.limit),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+        }
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+def priority_class_config(name: str, defaults: tuple) -> tuple:
+    max_concurrency, max_queue, target_latency_ms, retry_after = defaults
+    prefix = name.upper()
+    target_latency_ms = os.environ.get(f'{prefix}_TARGET_LATENCY_MS', target_latency_ms)
+    return (
+        int(os.environ.get(f'{prefix}_MAX_CONCURRENCY', max_concurrency)),
+        int(os.environ.get(f'{prefix}_MAX_QUEUE', max_queue)),
+        float(target_latency_ms) if target_latency_ms is not None else None,
+        retry_after,
+    )
+
+priority_limiters = {
+    name: ConcurrencyLimiter(name, *priority_class_config(name, defaults))
+    for name, defaults in PRIORITY_CLASS_DEFAULTS.items()
+}
+
+def priority_class(method: str, path: str) -> str:
+    for name, methods, prefix in PRIORITY_CLASS_ROUTES:
+        if (methods is None or method in methods) and path.startswith(prefix):
+            return name
+    return "standard"
+
+class PriorityLimitMiddleware:
+    """Runs each request under its priority class limiter and sheds load with 503."""
+
+    def __init__(self, app, limiters: dict):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        
+        limiter = self.limiters[priority_class(scope["method"], scope["path"])]
+        if not await limiter.acquire():
+            logger.warning(f"Shedding {scope['method']} {scope['path']}: {limiter.name} queue is full")
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+# Request coalescing
+class SingleFlight:
+    """Lets concurrent calls with the same key share one in-progress computation."""
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.metrics = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.metrics["executions"] += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+        else:
+            self.metrics["coalesced"] += 1
+        
+        # Shielded, so a disconnecting client does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {**self.metrics, "in_flight": len(self._calls)}
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
+
+single_flight_calls = SingleFlight()
+
+def single_flight(scope: Callable[..., Hashable]):
+    """Coalesces concurrent calls of a handler that share the same scope.
+
+    scope receives the handler's keyword arguments and returns what the
+    result depends on, e.g. the normalized query the caller may see.
+
+    A caller that joins a computation already in progress gets its result,
+    which may predate the caller's own writes: an admin who changes a rate and
+    immediately reloads the salary report can see the old numbers once.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            key = (handler.__name__, scope(**kwargs))
+            return await single_flight_calls.do(key, lambda: handler(*args, **kwargs))
+        return wrapper
+    return decorator
+
+def time_entries_query(user: dict) -> dict:
+    # Admin can see all entries, employees only see their own
+    return {} if user.get("role") in ["admin", "supervisor"] else {"user_id": user["id"]}
+
+def time_entries_scope(current_user: dict, **_) -> Hashable:
+    return tuple(sorted(time_entries_query(current_user).items()))
+
 # Auth routes
 @api_router.post("/auth/register", response_model=User)
 async def register(user_data: UserCreate, admin: dict = Depends(get_admin_user)):
@@ -262,6 +681,8 @@ async def delete_user(user_id: str, admin: dict = Depends(get_admin_user)):
 # Time entry routes
 @api_router.post("/time-entries", response_model=TimeEntry)
 async def create_time_entry(entry_data: TimeEntryCreate, current_user: dict = Depends(get_current_user)):
+    await ensure_month_not_archived(entry_data.date)
+    
     entry_dict = entry_data.model_dump()
     entry_dict["user_id"] = current_user["id"]
     entry_obj = TimeEntry(**entry_dict)
@@ -270,15 +691,15 @@ async def create_time_entry(entry_data: TimeEntryCreate, current_user: dict = De
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     
-    await db.time_entries.insert_one(doc)
+    if time_entry_inserts:
+        await time_entry_inserts.insert(doc)
+    else:
+        await db.time_entries.insert_one(doc)
     return entry_obj
 
 @api_router.get("/time-entries", response_model=List[TimeEntry])
 async def get_time_entries(current_user: dict = Depends(get_current_user)):
-    # Admin can see all entries, employees only see their own
-    query = {} if current_user.get("role") in ["admin", "supervisor"] else {"user_id": current_user["id"]}
-    
-    entries = await db.time_entries.find(query, {"_id": 0}).to_list(10000)
+    entries = await db.time_entries.find(time_entries_query(current_user), {"_id": 0}).to_list(10000)
     
     for entry in entries:
         if isinstance(entry['created_at'], str):
@@ -289,46 +710,53 @@ async def get_time_entries(current_user: dict = Depends(get_current_user)):
     return entries
 
 @api_router.get("/time-entries/with-calculations", response_model=List[TimeEntryWithRate])
+@single_flight(time_entries_scope)
 async def get_time_entries_with_calculations(current_user: dict = Depends(get_current_user)):
-    # Get time entries
-    query = {} if current_user.get("role") in ["admin", "supervisor"] else {"user_id": current_user["id"]}
-    entries = await db.time_entries.find(query, {"_id": 0}).to_list(10000)
-    
-    # Get all users for rate lookup
-    users = await db.users.find({}, {"_id": 0}).to_list(1000)
-    user_map = {u["id"]: u for u in users}
-    
-    result = []
-    for entry in entries:
-        user = user_map.get(entry["user_id"])
-        if not user:
-            continue
-        
-        hours = entry.get("hours", 0)
-        description = entry.get("description", "").lower()
-        
-        # Check if "delegacja" is in the description
-        is_delegacja = "delegacja" in description or "delegację" in description
-        
-        if is_delegacja:
-            applied_rate = user.get("hourly_rate_delegacja", user.get("hourly_rate", 0))
-        else:
-            applied_rate = user.get("hourly_rate", 0)
-        
-        calculated_salary = hours * applied_rate
-        
-        result.append(TimeEntryWithRate(
-            id=entry["id"],
-            user_id=entry["user_id"],
-            date=entry["date"],
-            hours=hours,
-            description=entry.get("description"),
-            is_delegacja=is_delegacja,
-            applied_rate=applied_rate,
-            calculated_salary=calculated_salary
-        ))
-    
-    return result
+    pipeline = [
+        {"$match": time_entries_query(current_user)},
+        # Fetch only the rate fields of the referenced user
+        {"$lookup": {
+            "from": "users",
+            "let": {"user_id": "$user_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$user_id"]}}},
+                {"$project": {"_id": 0, "hourly_rate": 1, "hourly_rate_delegacja": 1}},
+            ],
+            "as": "user",
+        }},
+        # Entries of users that no longer exist are skipped
+        {"$unwind": "$user"},
+        {"$addFields": {
+            # Check if "delegacja" is in the description
+            "is_delegacja": {"$regexMatch": {
+                "input": {"$ifNull": ["$description", ""]},
+                "regex": "delegacj[aę]",
+                "options": "i",
+            }},
+            "hours": {"$ifNull": ["$hours", 0]},
+            "regular_rate": {"$ifNull": ["$user.hourly_rate", 0]},
+        }},
+        {"$addFields": {
+            "applied_rate": {"$cond": [
+                "$is_delegacja",
+                {"$ifNull": ["$user.hourly_rate_delegacja", "$regular_rate"]},
+                "$regular_rate",
+            ]},
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "user_id": 1,
+            "date": 1,
+            "hours": 1,
+            "description": 1,
+            "is_delegacja": 1,
+            "applied_rate": 1,
+            "calculated_salary": {"$multiply": ["$hours", "$applied_rate"]},
+        }},
+    ]
+    
+    return [entry async for entry in db.time_entries.aggregate(pipeline)]
 
 @api_router.put("/time-entries/{entry_id}", response_model=TimeEntry)
 async def update_time_entry(entry_id: str, entry_data: TimeEntryUpdate, current_user: dict = Depends(get_current_user)):
@@ -341,6 +769,9 @@ async def update_time_entry(entry_id: str, entry_data: TimeEntryUpdate, current_
         raise HTTPException(status_code=403, detail="Access denied")
     
     update_data = entry_data.model_dump(exclude_unset=True)
+    if update_data.get("date"):
+        await ensure_month_not_archived(update_data["date"])
+    
     if update_data:
         update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
         await db.time_entries.update_one({"id": entry_id}, {"$set": update_data})
@@ -371,52 +802,167 @@ async def delete_time_entry(entry_id: str, current_user: dict = Depends(get_curr
 
 # Reports
 @api_router.get("/reports/salary", response_model=List[SalaryReport])
+@single_flight(lambda **_: "all")  # Admins and supervisors see the same report
 async def get_salary_report(admin: dict = Depends(get_admin_user)):
     users = await db.users.find({}, {"_id": 0}).to_list(1000)
     entries = await db.time_entries.find({}, {"_id": 0}).to_list(10000)
     
+    # Archived months only keep their totals, so add those to the live entries
+    archived_totals = await db.time_entries_archive.aggregate([
+        {"$unwind": "$users"},
+        {"$group": {
+            "_id": "$users.user_id",
+            "total_hours": {"$sum": "$users.total_hours"},
+            "total_hours_delegacja": {"$sum": "$users.total_hours_delegacja"},
+            "total_salary": {"$sum": "$users.total_salary"},
+        }},
+    ]).to_list(None)
+    archived_map = {t["_id"]: t for t in archived_totals}
+    
     report = []
     for user in users:
         user_entries = [e for e in entries if e.get("user_id") == user.get("id")]
+        user_report = build_salary_report(user, user_entries)
         
-        total_hours_regular = 0
-        total_hours_delegacja = 0
-        total_salary = 0
+        archived = archived_map.get(user.get("id"))
+        if archived:
+            user_report.total_hours += archived["total_hours"]
+            user_report.total_hours_delegacja += archived["total_hours_delegacja"]
+            user_report.total_salary += archived["total_salary"]
         
-        for entry in user_entries:
-            hours = entry.get("hours", 0)
-            description = entry.get("description", "").lower()
-            
-            # Check if "delegacja" is in the description
-            if "delegacja" in description or "delegację" in description:
-                # Use delegacja rate
-                rate = user.get("hourly_rate_delegacja", user.get("hourly_rate", 0))
-                total_hours_delegacja += hours
-            else:
-                # Use regular rate
-                rate = user.get("hourly_rate", 0)
-                total_hours_regular += hours
-            
-            total_salary += hours * rate
+        report.append(user_report)
+    
+    return report
+
+# Archive
+@api_router.post("/archive/run", response_model=ArchiveRunResult)
+async def run_archive(before: Optional[str] = None, admin: dict = Depends(get_admin_user)):
+    if admin.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only main admin can archive time entries")
+    
+    # Only closed months (before the current one) can be archived
+    before = parse_month(before) if before else shift_month(current_month(), -ARCHIVE_CUTOFF_MONTHS)
+    if before > current_month():
+        raise HTTPException(status_code=400, detail="Only closed months can be archived")
+    
+    months = await db.time_entries.aggregate([
+        {"$match": {"date": {"$lt": f"{before}-01", "$regex": ENTRY_DATE_PATTERN}}},
+        {"$group": {"_id": {"$substrCP": ["$date", 0, 7]}}},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+    
+    users = await db.users.find({}, {"_id": 0, "hashed_password": 0}).to_list(1000)
+    user_map = {u["id"]: u for u in users}
+    
+    result = ArchiveRunResult(before=before, archived_months=[], skipped_months=[], archived_entries=0)
+    for group in months:
+        month = group["_id"]
+        month_query = {"date": {"$gte": f"{month}-01", "$lt": f"{shift_month(month, 1)}-01", "$regex": ENTRY_DATE_PATTERN}}
+        entries = await db.time_entries.find(month_query, {"_id": 0}).to_list(None)
+        
+        entries_by_user = {}
+        for entry in entries:
+            entries_by_user.setdefault(entry["user_id"], []).append(entry)
         
-        total_hours = total_hours_regular + total_hours_delegacja
+        user_reports = [
+            build_salary_report(user_map.get(user_id, {"id": user_id}), user_entries)
+            for user_id, user_entries in entries_by_user.items()
+        ]
+        
+        doc = {
+            "month": month,
+            "entry_count": len(entries),
+            "total_hours": sum(r.total_hours for r in user_reports),
+            "total_salary": sum(r.total_salary for r in user_reports),
+            "archived_at": datetime.now(timezone.utc).isoformat(),
+            "users": [r.model_dump() for r in user_reports],
+            "entries_gz": gzip.compress(json.dumps(entries).encode("utf-8")),
+        }
+        
+        # Archived months are immutable, so a month that is already archived is left alone
+        try:
+            await db.time_entries_archive.insert_one(doc)
+        except DuplicateKeyError:
+            # A previous run may have stopped before deleting the archived entries
+            archived = await db.time_entries_archive.find_one({"month": month}, {"_id": 0, "entries_gz": 1})
+            archived_ids = [e["id"] for e in json.loads(gzip.decompress(archived["entries_gz"]))]
+            deleted = await db.time_entries.delete_many({"id": {"$in": archived_ids}})
+            
+            remaining = len(entries) - deleted.deleted_count
+            if deleted.deleted_count:
+                logger.info(f"Month {month} is already archived, removed {deleted.deleted_count} leftover entries")
+            if remaining:
+                logger.warning(f"Month {month} is already archived, skipping {remaining} entries")
+            result.skipped_months.append(month)
+            continue
         
-        report.append(SalaryReport(
-            user_id=user.get("id"),
-            user_name=user.get("full_name"),
-            position=user.get("position"),
-            hourly_rate=user.get("hourly_rate"),
-            hourly_rate_delegacja=user.get("hourly_rate_delegacja", 0),
-            total_hours=total_hours,
-            total_hours_delegacja=total_hours_delegacja,
-            total_salary=total_salary
-        ))
+        await db.time_entries.delete_many({"id": {"$in": [e["id"] for e in entries]}})
+        result.archived_months.append(month)
+        result.archived_entries += len(entries)
+    
+    # Entries with a date that is not YYYY-MM-DD cannot be assigned to a month
+    result.skipped_malformed_entries = await db.time_entries.count_documents(
+        {"date": {"$lt": f"{before}-01", "$not": {"$regex": ENTRY_DATE_PATTERN}}}
+    )
+    if result.skipped_malformed_entries:
+        logger.warning(f"Skipped {result.skipped_malformed_entries} time entries with a malformed date")
+    
+    logger.info(f"Archived {result.archived_entries} time entries before {before}")
+    return result
+
+@api_router.get("/archive", response_model=List[ArchivedMonth])
+async def get_archived_months(admin: dict = Depends(get_admin_user)):
+    months = await db.time_entries_archive.find({}, {"_id": 0, "entries_gz": 0}).sort("month", 1).to_list(None)
     
-    return report
+    for month in months:
+        month['archived_at'] = datetime.fromisoformat(month['archived_at'])
+    
+    return months
+
+@api_router.get("/archive/{month}", response_model=ArchivedMonth)
+async def get_archived_month(month: str, admin: dict = Depends(get_admin_user)):
+    archived = await db.time_entries_archive.find_one({"month": parse_month(month)}, {"_id": 0, "entries_gz": 0})
+    if not archived:
+        raise HTTPException(status_code=404, detail="Archived month not found")
+    
+    archived['archived_at'] = datetime.fromisoformat(archived['archived_at'])
+    return ArchivedMonth(**archived)
+
+@api_router.get("/archive/{month}/entries", response_model=List[TimeEntry])
+async def get_archived_entries(month: str, current_user: dict = Depends(get_current_user)):
+    archived = await db.time_entries_archive.find_one({"month": parse_month(month)}, {"_id": 0, "entries_gz": 1})
+    if not archived:
+        raise HTTPException(status_code=404, detail="Archived month not found")
+    
+    entries = json.loads(gzip.decompress(archived["entries_gz"]))
+    
+    # Admin can see all entries, employees only see their own
+    if current_user.get("role") not in ["admin", "supervisor"]:
+        entries = [e for e in entries if e.get("user_id") == current_user["id"]]
+    
+    for entry in entries:
+        if isinstance(entry['created_at'], str):
+            entry['created_at'] = datetime.fromisoformat(entry['created_at'])
+        if isinstance(entry['updated_at'], str):
+            entry['updated_at'] = datetime.fromisoformat(entry['updated_at'])
+    
+    return entries
+
+# Metrics
+@api_router.get("/metrics")
+async def get_metrics(admin: dict = Depends(get_admin_user)):
+    return {
+        "time_entry_inserts": time_entry_inserts.stats() if time_entry_inserts else None,
+        "single_flight": single_flight_calls.stats(),
+        "priority_classes": {name: limiter.stats() for name, limiter in priority_limiters.items()},
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so that shed requests still carry CORS headers
+app.add_middleware(PriorityLimitMiddleware, limiters=priority_limiters)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -434,8 +980,16 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if time_entry_inserts:
+        await time_entry_inserts.close()
     client.close()
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.users.create_index("id", unique=True)
+    await db.time_entries.create_index("user_id")
+    await db.time_entries_archive.create_index("month", unique=True)
+
 # Create initial admin user on startup
 @app.on_event("startup")
 async def create_admin():
@@ -215,6 +215,61 @@ class WorkHoursAPITester:
             return True
         return False
 
+    def test_time_entries_with_calculations(self):
+        """Test delegacja rates and salaries in time entries with calculations"""
+        success, _ = self.run_test(
+            "Set Delegacja Rate",
+            "PUT",
+            f"users/{self.employee_id}",
+            200,
+            data={"hourly_rate_delegacja": 400.0},
+            token=self.admin_token
+        )
+        if not success:
+            return False
+        
+        success, entry = self.run_test(
+            "Create Delegacja Time Entry",
+            "POST",
+            "time-entries",
+            200,
+            data={
+                "date": date.today().strftime("%Y-%m-%d"),
+                "hours": 5.0,
+                "description": "Delegacja do Krakowa"
+            },
+            token=self.employee_token
+        )
+        if not success or 'id' not in entry:
+            return False
+        
+        success, response = self.run_test(
+            "Time Entries With Calculations (Employee)",
+            "GET",
+            "time-entries/with-calculations",
+            200,
+            token=self.employee_token
+        )
+        if not success or not isinstance(response, list):
+            return False
+        
+        if any(row.get('user_id') != self.employee_id for row in response):
+            print("❌ Employee sees time entries of other users")
+            return False
+        
+        delegacja_row = next((row for row in response if row.get('id') == entry['id']), None)
+        if not delegacja_row or not delegacja_row.get('is_delegacja') or delegacja_row.get('applied_rate') != 400.0:
+            print(f"❌ Delegacja entry not calculated with delegacja rate: {delegacja_row}")
+            return False
+        
+        for row in response:
+            if abs(row['calculated_salary'] - row['hours'] * row['applied_rate']) > 0.01:
+                print(f"❌ Wrong salary for entry {row['id']}: {row['calculated_salary']}")
+                return False
+        
+        print(f"Employee has {len(response)} calculated entries, delegacja entry = {delegacja_row['calculated_salary']} грн")
+        return True
+
     def test_salary_report(self):
         """Test salary report generation"""
         success, response = self.run_test(
@@ -231,6 +286,147 @@ class WorkHoursAPITester:
             return True
         return False
 
+    def _employee_salary(self):
+        success, response = self.run_test(
+            "Salary Report (Employee Totals)",
+            "GET",
+            "reports/salary",
+            200,
+            token=self.admin_token
+        )
+        if not success:
+            return None
+        return next((r for r in response if r.get('user_id') == self.employee_id), None)
+
+    def test_archive_run(self):
+        """Test archiving a closed month and reading it back"""
+        # A month long before any real data, unique per run, so only this test's entry is archived
+        year = 1000 + int(datetime.now().timestamp()) % 900
+        month = f"{year:04d}-01"
+        
+        success, entry = self.run_test(
+            "Create Entry In Old Month",
+            "POST",
+            "time-entries",
+            200,
+            data={"date": f"{month}-15", "hours": 3.0, "description": "Archiwum"},
+            token=self.employee_token
+        )
+        if not success:
+            return False
+        
+        before = self._employee_salary()
+        if not before:
+            return False
+        
+        success, response = self.run_test(
+            "Archive Run",
+            "POST",
+            f"archive/run?before={year:04d}-02",
+            200,
+            token=self.admin_token
+        )
+        if not success or month not in response.get('archived_months', []):
+            print(f"❌ Month {month} was not archived: {response}")
+            return False
+        
+        success, entries = self.run_test(
+            "Time Entries After Archive",
+            "GET",
+            "time-entries",
+            200,
+            token=self.employee_token
+        )
+        if not success or any(e.get('id') == entry['id'] for e in entries):
+            print("❌ Archived entry is still in time entries")
+            return False
+        
+        success, archived = self.run_test(
+            "Archived Entries",
+            "GET",
+            f"archive/{month}/entries",
+            200,
+            token=self.employee_token
+        )
+        if not success or not any(e.get('id') == entry['id'] for e in archived):
+            print("❌ Archived entry cannot be read back")
+            return False
+        
+        after = self._employee_salary()
+        if not after:
+            return False
+        for field in ('total_hours', 'total_hours_delegacja', 'total_salary'):
+            if abs(after[field] - before[field]) > 0.01:
+                print(f"❌ Salary report {field} changed after archive: {before[field]} -> {after[field]}")
+                return False
+        
+        success, _ = self.run_test(
+            "Create Entry In Archived Month",
+            "POST",
+            "time-entries",
+            400,
+            data={"date": f"{month}-16", "hours": 1.0},
+            token=self.employee_token
+        )
+        if not success:
+            return False
+        
+        success, response = self.run_test(
+            "Archive Rerun",
+            "POST",
+            f"archive/run?before={year:04d}-02",
+            200,
+            token=self.admin_token
+        )
+        if not success or month in response.get('archived_months', []):
+            print(f"❌ Archived month was archived again: {response}")
+            return False
+        
+        print(f"Archived {month}, salary totals unchanged: {after['total_salary']} грн")
+        return True
+
+    def test_archived_months(self):
+        """Test listing archived months"""
+        success, response = self.run_test(
+            "Archived Months",
+            "GET",
+            "archive",
+            200,
+            token=self.admin_token
+        )
+        if success and isinstance(response, list):
+            print(f"Archive has {len(response)} months")
+            for month in response:
+                print(f"  - {month.get('month')}: {month.get('entry_count')} entries = {month.get('total_salary')} грн")
+            return True
+        return False
+
+    def test_archive_requires_admin(self):
+        """Test that employees cannot run the archive"""
+        success, _ = self.run_test(
+            "Archive Run (Employee)",
+            "POST",
+            "archive/run",
+            403,
+            token=self.employee_token
+        )
+        return success
+
+    def test_metrics(self):
+        """Test load shedding and batching metrics"""
+        success, response = self.run_test(
+            "Metrics",
+            "GET",
+            "metrics",
+            200,
+            token=self.admin_token
+        )
+        if success and isinstance(response, dict):
+            for name, stats in response.get("priority_classes", {}).items():
+                print(f"  - {name}: {stats.get('in_flight')} in flight, {stats.get('queue_depth')} queued, {stats.get('rejected')} rejected")
+            return True
+        return False
+
     def test_delete_time_entry(self):
         """Test deleting a time entry"""
         success, response = self.run_test(
@@ -283,7 +479,12 @@ def main():
         ("Get Time Entries (Employee)", tester.test_get_time_entries),
         ("Get All Time Entries (Admin)", tester.test_get_all_time_entries_admin),
         ("Update Time Entry", tester.test_update_time_entry),
+        ("Time Entries With Calculations", tester.test_time_entries_with_calculations),
         ("Salary Report", tester.test_salary_report),
+        ("Archive Run", tester.test_archive_run),
+        ("Archived Months", tester.test_archived_months),
+        ("Archive Run (Employee)", tester.test_archive_requires_admin),
+        ("Metrics", tester.test_metrics),
         ("Delete Time Entry", tester.test_delete_time_entry),
         ("Delete Employee", tester.test_delete_employee),
     ]
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError, WriteError
+
+from server import InsertCoalescer
+
+
+class FakeCollection:
+    def __init__(self, details=None, error=None):
+        self.batches = []
+        self.details = details
+        self.error = error
+
+    async def insert_many(self, docs, ordered=True):
+        self.batches.append(len(docs))
+        for index, doc in enumerate(docs):
+            doc["_id"] = f"id-{len(self.batches)}-{index}"
+        if self.error:
+            raise self.error
+        if self.details:
+            raise BulkWriteError(self.details)
+
+
+def insert_all(coalescer, count):
+    return asyncio.gather(*[coalescer.insert({"n": n}) for n in range(count)], return_exceptions=True)
+
+
+def test_flushes_on_size():
+    async def scenario():
+        collection = FakeCollection()
+        coalescer = InsertCoalescer(collection, max_batch_size=3, max_wait_ms=10_000)
+        results = await asyncio.wait_for(insert_all(coalescer, 6), timeout=1)
+
+        assert collection.batches == [3, 3]
+        assert results == ["id-1-0", "id-1-1", "id-1-2", "id-2-0", "id-2-1", "id-2-2"]
+        assert coalescer.stats()["flushed_on_size"] == 2
+        assert coalescer.stats()["avg_batch_fill"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_flushes_on_timeout():
+    async def scenario():
+        collection = FakeCollection()
+        coalescer = InsertCoalescer(collection, max_batch_size=10, max_wait_ms=5)
+        results = await insert_all(coalescer, 4)
+
+        assert collection.batches == [4]
+        assert len(set(results)) == 4
+        assert coalescer.stats()["flushed_on_timeout"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_fails_only_its_caller():
+    async def scenario():
+        collection = FakeCollection(details={
+            "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key"}],
+            "writeConcernErrors": [],
+        })
+        coalescer = InsertCoalescer(collection, max_batch_size=3, max_wait_ms=5)
+        results = await insert_all(coalescer, 3)
+
+        assert results[0] == "id-1-0"
+        assert isinstance(results[1], DuplicateKeyError)
+        assert results[2] == "id-1-2"
+        assert coalescer.stats()["failed_documents"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_other_write_error_is_write_error():
+    async def scenario():
+        collection = FakeCollection(details={
+            "writeErrors": [{"index": 0, "code": 121, "errmsg": "Document failed validation"}],
+            "writeConcernErrors": [],
+        })
+        coalescer = InsertCoalescer(collection, max_batch_size=2, max_wait_ms=5)
+        results = await insert_all(coalescer, 2)
+
+        assert type(results[0]) is WriteError
+        assert results[0].code == 121
+        assert results[1] == "id-1-1"
+
+    asyncio.run(scenario())
+
+
+def test_write_concern_error_fails_every_caller():
+    async def scenario():
+        collection = FakeCollection(details={
+            "writeErrors": [],
+            "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}],
+        })
+        coalescer = InsertCoalescer(collection, max_batch_size=2, max_wait_ms=5)
+        results = await insert_all(coalescer, 2)
+
+        assert all(isinstance(r, WriteConcernError) for r in results)
+
+    asyncio.run(scenario())
+
+
+def test_non_bulk_error_fails_every_caller():
+    async def scenario():
+        error = ConnectionError("connection lost")
+        coalescer = InsertCoalescer(FakeCollection(error=error), max_batch_size=3, max_wait_ms=5)
+        results = await insert_all(coalescer, 3)
+
+        assert results == [error, error, error]
+        assert coalescer.stats()["failed_documents"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_close_flushes_pending_inserts():
+    async def scenario():
+        collection = FakeCollection()
+        coalescer = InsertCoalescer(collection, max_batch_size=10, max_wait_ms=10_000)
+        pending = asyncio.ensure_future(insert_all(coalescer, 2))
+        await asyncio.sleep(0)
+        assert collection.batches == []
+
+        await coalescer.close()
+        assert collection.batches == [2]
+        assert await pending == ["id-1-0", "id-1-1"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_break_the_batch():
+    async def scenario():
+        collection = FakeCollection()
+        coalescer = InsertCoalescer(collection, max_batch_size=10, max_wait_ms=5)
+        cancelled = asyncio.ensure_future(coalescer.insert({"n": 0}))
+        kept = asyncio.ensure_future(coalescer.insert({"n": 1}))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        assert await kept == "id-1-1"
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    asyncio.run(scenario())
@@ -0,0 +1,129 @@
+import asyncio
+
+from server import ConcurrencyLimiter, PriorityLimitMiddleware, priority_class
+
+
+def make_limiter(max_concurrency=1, max_queue=1, target_latency_ms=None):
+    return ConcurrencyLimiter("test", max_concurrency, max_queue, target_latency_ms, retry_after=7)
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, max_queue=1)
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+
+        assert not await limiter.acquire()
+        assert limiter.stats()["rejected"] == 1
+        assert limiter.stats()["queue_depth"] == 1
+
+        queued.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_queued_request_is_admitted_on_release():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, max_queue=1)
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not queued.done()
+
+        limiter.release(0.01)
+        assert await queued
+        assert limiter.stats()["in_flight"] == 1
+        assert limiter.stats()["queue_depth"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_while_queued_leaves_the_queue():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, max_queue=2)
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+
+        queued.cancel()
+        await asyncio.sleep(0)
+        assert queued.cancelled()
+        assert limiter.stats()["queue_depth"] == 0
+
+        limiter.release(0.01)
+        assert limiter.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_after_slot_handover_passes_the_slot_on():
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, max_queue=2)
+        assert await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+
+        # The slot is handed to first, which is cancelled before it resumes
+        limiter.release(0.01)
+        first.cancel()
+
+        assert await second
+        assert first.cancelled()
+        assert limiter.stats()["in_flight"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_fixed_limit_ignores_latency():
+    limiter = make_limiter(max_concurrency=4)
+    for _ in range(10):
+        limiter.in_flight += 1
+        limiter.release(60)
+    assert limiter.stats()["limit"] == 4
+
+
+def test_adaptive_limit_backs_off_and_recovers():
+    limiter = make_limiter(max_concurrency=4, target_latency_ms=100)
+    for _ in range(10):
+        limiter.in_flight += 1
+        limiter.release(1)
+    assert limiter.stats()["limit"] == 1
+
+    for _ in range(20):
+        limiter.in_flight += 1
+        limiter.release(0.01)
+    assert limiter.stats()["limit"] == 4
+
+
+def test_middleware_sheds_with_retry_after():
+    async def app(scope, receive, send):
+        raise AssertionError("shed request must not reach the app")
+
+    async def scenario():
+        limiter = make_limiter(max_concurrency=1, max_queue=0)
+        assert await limiter.acquire()
+        middleware = PriorityLimitMiddleware(app, {"standard": limiter})
+
+        sent = []
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/api/users", "headers": []}
+        await middleware(scope, None, send)
+
+        start = sent[0]
+        assert start["status"] == 503
+        assert (b"retry-after", b"7") in start["headers"]
+
+    asyncio.run(scenario())
+
+
+def test_priority_classes():
+    assert priority_class("POST", "/api/time-entries") == "interactive"
+    assert priority_class("DELETE", "/api/time-entries/1") == "interactive"
+    assert priority_class("GET", "/api/time-entries") == "standard"
+    assert priority_class("GET", "/api/time-entries/with-calculations") == "heavy"
+    assert priority_class("GET", "/api/reports/salary") == "heavy"
+    assert priority_class("POST", "/api/auth/login") == "auth"
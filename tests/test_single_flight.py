@@ -0,0 +1,72 @@
+import asyncio
+
+from server import single_flight, time_entries_scope
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    @single_flight(lambda **_: "all")
+    async def report(admin: dict):
+        calls.append(admin["id"])
+        await asyncio.sleep(0.01)
+        return [len(calls)]
+
+    async def scenario():
+        return await asyncio.gather(*[report(admin={"id": f"admin-{n}"}) for n in range(5)])
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_different_scopes_do_not_share_results():
+    @single_flight(time_entries_scope)
+    async def entries(current_user: dict):
+        await asyncio.sleep(0.01)
+        return [current_user["id"]]
+
+    async def scenario():
+        return await asyncio.gather(
+            entries(current_user={"id": "employee-a", "role": "employee"}),
+            entries(current_user={"id": "employee-b", "role": "employee"}),
+            entries(current_user={"id": "admin", "role": "admin"}),
+            entries(current_user={"id": "supervisor", "role": "supervisor"}),
+        )
+
+    employee_a, employee_b, admin, supervisor = asyncio.run(scenario())
+    assert employee_a == ["employee-a"]
+    assert employee_b == ["employee-b"]
+    # Admins and supervisors see the same entries, so they share one computation
+    assert supervisor is admin
+
+
+def test_exception_reaches_every_waiter():
+    calls = []
+
+    @single_flight(lambda **_: "all")
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("report failed")
+
+    async def scenario():
+        return await asyncio.gather(*[failing() for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_later_call_starts_a_new_execution():
+    calls = []
+
+    @single_flight(lambda **_: "all")
+    async def report():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        return await report(), await report()
+
+    assert asyncio.run(scenario()) == (1, 2)